@@ -2,10 +2,10 @@
 
 # Normal import
 try:
-    from cannocdata.library.tools import load_arguments, load_config, print_csv, print_longest, translate_csv, combine_csvs, transcode, compare_columns, test01, fill_missing, export
+    from cannocdata.library.tools import load_arguments, get_parser, print_csv, print_longest, translate_csv, combine_csvs, transcode, compare_columns, test01, fill_missing, export
 # Allow local import for development purposes
 except ModuleNotFoundError:
-    from library.tools import load_arguments, load_config, print_csv, print_longest, translate_csv, combine_csvs, transcode, compare_columns, test01, fill_missing, export
+    from library.tools import load_arguments, get_parser, print_csv, print_longest, translate_csv, combine_csvs, transcode, compare_columns, test01, fill_missing, export
 
 def main():
     arguments = load_arguments()
@@ -16,22 +16,38 @@ def main():
         id = arguments['id']
         combine_csvs(sources, destination, id)
     elif arguments['task'] == "compare_columns":
-        compare_columns(source, destination)
+        compare_columns(source, destination, arguments['id'],
+                        arguments['workers'])
     elif arguments['task'] == "print":
-        print_csv(source)
+        print_csv(source,
+                  arguments['columns'],
+                  arguments['noc_code'],
+                  arguments['noc_prefix'],
+                  arguments['limit'],
+                  arguments['offset'] or 0,
+                  arguments['format'] or "csv")
     elif arguments['task'] == "print_longest" and source:
         print_longest(source)
     elif arguments['task'] == "transcode":
         transcode(source, destination)
     elif arguments['task'] == "translate":
-        translate_csv()
+        keys = {}
+        if len(arguments['keys_from']) == len(arguments['keys_to']):
+            keys = dict(zip(arguments['keys_from'], arguments['keys_to']))
+        translate_csv(source, destination, arguments['lang_from'],
+                      arguments['lang_to'] or "en", keys,
+                      arguments['translator'] or "argos",
+                      arguments['workers'], arguments['threads'] or 1)
     elif arguments['task'] == "export":
-        export(source, destination)
+        export(source, destination, None, arguments['format'] or "csv",
+               arguments['workers'], arguments['threads'] or 1)
     elif arguments['task'] == "fill_missing":
         fill_missing(source, destination)
     elif arguments['task'] == "test":
         test01(sources, destination)
         # test02(source, destination)
+    else:
+        get_parser().print_help()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+'''
+    A local stand-in for the Azure Translator v3 api and a throughput harness
+    for the translation entry points
+
+    The stub implements the /translate contract (api-version, from, to,
+    subscription key, request limits, error bodies) and can add latency,
+    throttle (429) and fail (500) requests. Its translations are the source
+    texts prefixed by the destination language.
+
+    Usage:
+        python -m cannocdata.library.azurestub serve --port 8765 --latency 0.05
+        python -m cannocdata.library.azurestub bench --entry fill_missing
+'''
+
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from . import tools
+
+MAX_ELEMENTS = 1000
+MAX_CHARACTERS = 50000
+ENTRIES = ["translate_azure", "translate_csv_azure", "fill_missing"]
+
+
+class AzureStubServer(ThreadingHTTPServer):
+    '''A threaded http server answering like the Azure Translator v3 api
+
+    Args:
+        address         : The (host, port) to listen on, port 0 picks one
+        latency         : The seconds added to every response
+        jitter          : The maximum random seconds added to the latency
+        rate_limit      : The requests per second allowed before throttling,
+                          unlimited if empty
+        throttle_rate   : The probability of throttling a request
+        failure_rate    : The probability of failing a request
+        retry_after     : The Retry-After header of throttled requests
+        seed            : The seed of the random throttling and failures
+    '''
+    daemon_threads = True
+
+    def __init__(self,
+                 address=("127.0.0.1", 0),
+                 latency=0,
+                 jitter=0,
+                 rate_limit=None,
+                 throttle_rate=0,
+                 failure_rate=0,
+                 retry_after=1,
+                 seed=None):
+        super().__init__(address, AzureStubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = rate_limit or 0
+        self.refilled = time.monotonic()
+        self.stats = {
+            "requests": 0,
+            "translated": 0,
+            "characters": 0,
+            "throttled": 0,
+            "failed": 0,
+            "rejected": 0,
+        }
+
+    @property
+    def endpoint(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, stat, value=1):
+        with self.lock:
+            self.stats[stat] += value
+
+    def throttle(self):
+        '''Decide if a request is throttled, with a token bucket of rate_limit
+        requests per second and the random throttle_rate
+
+        Returns:
+            throttled: True if the request is throttled
+        '''
+        with self.lock:
+            if self.random.random() < self.throttle_rate:
+                return True
+            if not self.rate_limit:
+                return False
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate_limit,
+                self.tokens + (now - self.refilled) * self.rate_limit)
+            self.refilled = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+
+class AzureStubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers={}):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RequestId", str(uuid.uuid4()))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, code, message, headers={}):
+        self.send_json(status, {"error": {
+            "code": code,
+            "message": message
+        }}, headers)
+
+    def do_POST(self):
+        server = self.server
+        server.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = self.rfile.read(length)
+
+        latency = server.latency + server.random.uniform(0, server.jitter)
+        if latency:
+            time.sleep(latency)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.rstrip("/") != "/translate":
+            server.count("rejected")
+            return self.send_error_json(404, 404001,
+                                        "The requested resource was not found.")
+        if not self.headers.get("Ocp-Apim-Subscription-Key"):
+            server.count("rejected")
+            return self.send_error_json(
+                401, 401000, "The request is not authorized because "
+                "credentials are missing or invalid.")
+        if query.get("api-version") != ["3.0"]:
+            server.count("rejected")
+            return self.send_error_json(
+                400, 400021, "The API version parameter is missing or invalid.")
+        if not query.get("to"):
+            server.count("rejected")
+            return self.send_error_json(
+                400, 400036, "The target language (\"To\" field) is missing "
+                "or invalid.")
+
+        if server.throttle():
+            server.count("throttled")
+            return self.send_error_json(
+                429, 429000, "The server rejected the request because the "
+                "client has exceeded request limits.",
+                {"Retry-After": str(server.retry_after)})
+        if server.fail():
+            server.count("failed")
+            return self.send_error_json(500, 500000,
+                                        "An unexpected error occurred.")
+
+        try:
+            elements = json.loads(payload.decode('utf-8'))
+            texts = [
+                element.get("Text", element.get("text")) for element in elements
+            ]
+        except (ValueError, AttributeError, TypeError):
+            server.count("rejected")
+            return self.send_error_json(400, 400074,
+                                        "The body of the request is not valid "
+                                        "JSON.")
+        if not isinstance(elements, list) or any(
+                not isinstance(text, str) for text in texts):
+            server.count("rejected")
+            return self.send_error_json(400, 400019,
+                                        "One of the texts is missing.")
+        if len(texts) > MAX_ELEMENTS:
+            server.count("rejected")
+            return self.send_error_json(400, 400077,
+                                        "The maximum request size has been "
+                                        "exceeded.")
+        characters = sum(len(text) for text in texts)
+        if characters > MAX_CHARACTERS:
+            server.count("rejected")
+            return self.send_error_json(400, 400050,
+                                        "The input text is too long.")
+
+        lang_from = query.get("from", [None])[0]
+        response = []
+        for text in texts:
+            result = {
+                "translations": [{
+                    "text": f"[{lang_to}] {text}",
+                    "to": lang_to
+                } for lang_to in query["to"]]
+            }
+            if not lang_from:
+                result["detectedLanguage"] = {"language": "en", "score": 1.0}
+            response.append(result)
+        server.count("translated", len(texts))
+        server.count("characters", characters)
+        self.send_json(200, response)
+
+
+def start_stub(host="127.0.0.1", port=0, **settings):
+    '''Start a stub server in a background thread
+
+    Args:
+        host        : The host to listen on
+        port        : The port to listen on, any free port if 0
+        settings    : The AzureStubServer settings
+
+    Returns:
+        server: The running server, stop it with shutdown()
+    '''
+    server = AzureStubServer((host, port), **settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def load_texts(source=None, limit=1000):
+    '''Load english texts to translate from an element csv
+
+    Args:
+        source  : The csv filepath, the main duties elements if empty
+        limit   : The maximum number of texts
+
+    Returns:
+        texts: The texts
+    '''
+    if not source:
+        source = tools.find_in_parents(
+            os.path.join("data", "elements", "Main duties.csv"))
+    with open(source, newline="", encoding='utf-8-sig') as input_file:
+        texts = []
+        for row in csv.DictReader(input_file):
+            if len(texts) >= limit:
+                break
+            texts.append(row["name_english"])
+    return texts
+
+
+def run_entry(entry, texts):
+    if entry == "translate_azure":
+        for text in texts:
+            tools.translate_azure(text, "en", "fr")
+    elif entry == "translate_csv_azure":
+        tools.translate_csv_azure([{
+            "name_english": text
+        } for text in texts], "en", "fr", {"name_english": "name_french"})
+    elif entry == "fill_missing":
+        fd, filepath = tempfile.mkstemp(suffix=".csv")
+        try:
+            with open(fd, 'w', newline="", encoding='utf-8') as output_file:
+                writer = csv.writer(output_file)
+                writer.writerow([
+                    "noc_code", "type_english", "name_english", "type_french",
+                    "name_french"
+                ])
+                for text in texts:
+                    writer.writerow(["00000", "Main duties", text, "", ""])
+            tools.fill_missing(filepath, filepath)
+        finally:
+            os.remove(filepath)
+    else:
+        raise ValueError(f"Unknown entry point: {entry}")
+
+
+def benchmark(entry, texts, server):
+    '''Drive a translation entry point against a stub server
+
+    Args:
+        entry   : One of ENTRIES
+        texts   : The texts to translate
+        server  : The running stub server
+
+    Returns:
+        report: The throughput of the entry point
+    '''
+    previous = tools._config
+    tools.set_config({
+        "azure": {
+            "endpoint": server.endpoint,
+            "subscription": "stub",
+            "region": "local",
+        }
+    })
+    for k in tools.azure_stats.keys():
+        tools.azure_stats[k] = 0
+
+    aborted = False
+    start = time.perf_counter()
+    try:
+        run_entry(entry, texts)
+    except SystemExit:
+        # translate_azure exits on errors left after its retries
+        aborted = True
+    elapsed = time.perf_counter() - start
+    tools.set_config(previous)
+
+    stats = dict(tools.azure_stats)
+    return {
+        "entry": entry,
+        "texts": len(texts),
+        "seconds": elapsed,
+        "requests": stats["requests"],
+        "retries": stats["retries"],
+        "characters": stats["characters"],
+        "requests_per_second": stats["requests"] / elapsed if elapsed else 0,
+        "characters_per_second":
+        stats["characters"] / elapsed if elapsed else 0,
+        "aborted": aborted,
+        "server": dict(server.stats),
+    }
+
+
+def print_benchmark(report):
+    print(f"{report['entry']}: {report['texts']} texts in "
+          f"{report['seconds']:.2f} seconds"
+          f"{' (aborted)' if report['aborted'] else ''}")
+    print(f"Requests:   {report['requests']} "
+          f"({report['requests_per_second']:.1f}/s)")
+    print(f"Characters: {report['characters']} "
+          f"({report['characters_per_second']:.0f}/s)")
+    print(f"Retries:    {report['retries']}")
+    server = report["server"]
+    print(f"Server:     {server['throttled']} throttled, {server['failed']} "
+          f"failed, {server['rejected']} rejected")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local Azure Translator stand-in and throughput harness")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="Run the stub server")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    bench = subparsers.add_parser("bench",
+                                  help="Drive the translation entry points")
+    bench.add_argument("--entry",
+                       choices=ENTRIES,
+                       action="append",
+                       help="The entry points to drive, all if empty")
+    bench.add_argument("--source", help="The element csv to translate")
+    bench.add_argument("--limit", type=int, default=500)
+    for subparser in (serve, bench):
+        subparser.add_argument("--latency", type=float, default=0)
+        subparser.add_argument("--jitter", type=float, default=0)
+        subparser.add_argument("--rate_limit", type=float)
+        subparser.add_argument("--throttle_rate", type=float, default=0)
+        subparser.add_argument("--failure_rate", type=float, default=0)
+        subparser.add_argument("--retry_after", type=float, default=1)
+        subparser.add_argument("--seed", type=int)
+    arguments = parser.parse_args()
+    settings = {
+        "latency": arguments.latency,
+        "jitter": arguments.jitter,
+        "rate_limit": arguments.rate_limit,
+        "throttle_rate": arguments.throttle_rate,
+        "failure_rate": arguments.failure_rate,
+        "retry_after": arguments.retry_after,
+        "seed": arguments.seed,
+    }
+
+    if arguments.command == "serve":
+        server = AzureStubServer((arguments.host, arguments.port), **settings)
+        print(f"Azure Translator stub listening on {server.endpoint}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return
+
+    texts = load_texts(arguments.source, arguments.limit)
+    for entry in arguments.entry or ENTRIES:
+        server = start_stub(**settings)
+        print_benchmark(benchmark(entry, texts, server))
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
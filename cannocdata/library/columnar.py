@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''
+    A small columnar file format used when pyarrow is not available
+
+    Layout:
+        MAGIC
+        column chunks (zlib compressed)
+        footer (json)
+        footer length (uint32 little endian)
+        MAGIC
+
+    Every column chunk either holds the plain values or, for dictionary
+    encoded columns, the dictionary followed by the codes of every row.
+'''
+
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"CNOCCOL1"
+EXTENSION = "ccol"
+
+
+def _to_le(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _code_typecode(size):
+    if size <= 0xFF:
+        return 'B'
+    if size <= 0xFFFF:
+        return 'H'
+    return 'I'
+
+
+def _pack_strings(values):
+    '''Pack a list of strings as their offsets followed by their bytes
+
+    Args:
+        values: The strings to pack
+
+    Returns:
+        data: The packed bytes
+    '''
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = array('I', [0])
+    total = 0
+    for value in encoded:
+        total += len(value)
+        offsets.append(total)
+    return struct.pack('<I', len(encoded)) + _to_le(offsets) + b"".join(encoded)
+
+
+def _unpack_strings(data, position=0):
+    '''Unpack strings packed by _pack_strings
+
+    Args:
+        data        : The packed bytes
+        position    : Where the packed strings start in data
+
+    Returns:
+        values      : The strings
+        position    : Where the packed strings end in data
+    '''
+    count = struct.unpack_from('<I', data, position)[0]
+    position += 4
+    offsets = _from_le('I', data[position:position + (count + 1) * 4])
+    position += (count + 1) * 4
+    blob = data[position:position + offsets[-1]]
+    values = [
+        blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)
+    ]
+    return values, position + offsets[-1]
+
+
+def _encode_column(values, dictionary):
+    if not dictionary:
+        return _pack_strings(values)
+    lookup = {}
+    for value in values:
+        if value not in lookup:
+            lookup[value] = len(lookup)
+    codes = array(_code_typecode(len(lookup)), [lookup[v] for v in values])
+    return _pack_strings(list(lookup)) + codes.typecode.encode() + _to_le(codes)
+
+
+def _decode_column(data, dictionary):
+    if not dictionary:
+        return _unpack_strings(data)[0]
+    keys, position = _unpack_strings(data)
+    codes = _from_le(chr(data[position]), data[position + 1:])
+    return [keys[code] for code in codes]
+
+
+def write_columnar(groups, destination, columns, dictionary_columns=()):
+    '''Write row groups to a columnar file
+
+    Args:
+        groups              : A list of (name, diclist) row groups
+        destination         : The destination filepath
+        columns             : The ordered column names
+        dictionary_columns  : The columns to dictionary encode
+
+    Returns:
+    '''
+    footer = {"columns": list(columns), "row_groups": []}
+    with open(destination, 'wb') as output_file:
+        output_file.write(MAGIC)
+        position = len(MAGIC)
+        for name, diclist in groups:
+            row_group = {"name": name, "num_rows": len(diclist), "chunks": []}
+            for column in columns:
+                values = [
+                    "" if row.get(column) is None else str(row.get(column))
+                    for row in diclist
+                ]
+                dictionary = column in dictionary_columns
+                chunk = zlib.compress(_encode_column(values, dictionary))
+                output_file.write(chunk)
+                row_group["chunks"].append({
+                    "column": column,
+                    "offset": position,
+                    "length": len(chunk),
+                    "encoding": "dictionary" if dictionary else "plain",
+                })
+                position += len(chunk)
+            footer["row_groups"].append(row_group)
+        footer = json.dumps(footer, ensure_ascii=False).encode('utf-8')
+        output_file.write(footer)
+        output_file.write(struct.pack('<I', len(footer)))
+        output_file.write(MAGIC)
+
+
+def read_columnar_footer(source):
+    '''Read the footer of a columnar file
+
+    Args:
+        source: The source filepath
+
+    Returns:
+        footer: The schema and the row groups of the file
+    '''
+    with open(source, 'rb') as input_file:
+        input_file.seek(-(len(MAGIC) + 4), 2)
+        length = struct.unpack('<I', input_file.read(4))[0]
+        if input_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a columnar file: {source}")
+        input_file.seek(-(len(MAGIC) + 4 + length), 2)
+        return json.loads(input_file.read(length).decode('utf-8'))
+
+
+def read_columnar(source, columns=None, row_groups=None):
+    '''Read a columnar file, only decoding the requested data
+
+    Args:
+        source      : The source filepath
+        columns     : The columns to read, all of them if empty
+        row_groups  : The names of the row groups to read, all if empty
+
+    Returns:
+        data: A dictionary of column names to lists of values
+    '''
+    footer = read_columnar_footer(source)
+    if not columns:
+        columns = footer["columns"]
+    data = {column: [] for column in columns}
+    with open(source, 'rb') as input_file:
+        for row_group in footer["row_groups"]:
+            if row_groups and row_group["name"] not in row_groups:
+                continue
+            for chunk in row_group["chunks"]:
+                if chunk["column"] not in data:
+                    continue
+                input_file.seek(chunk["offset"])
+                raw = zlib.decompress(input_file.read(chunk["length"]))
+                data[chunk["column"]] += _decode_column(
+                    raw, chunk["encoding"] == "dictionary")
+    return data
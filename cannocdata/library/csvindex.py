@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+'''
+    A sidecar index giving random access to the rows of a csv by code
+
+    The index maps every code to the byte ranges of its rows so a lookup only
+    parses the relevant slice of the memory mapped csv. It is stored next to
+    the csv (<csv>.idx) and rebuilt when the size or the mtime of the csv
+    changes.
+'''
+
+import codecs
+import csv
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
+
+EXTENSION = "idx"
+VERSION = 1
+
+# filepath: (stat, index, file, mmap)
+_cache = {}
+
+
+def _stat(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _records(input_file):
+    '''Iterate over the raw records of a binary csv file
+
+    A record spans several lines when a quoted field holds newlines.
+
+    Args:
+        input_file: The csv opened in binary mode
+
+    Returns:
+        records: An iterator of (start offset, end offset, record bytes)
+    '''
+    start = input_file.tell()
+    record = b""
+    for line in iter(input_file.readline, b""):
+        record += line
+        if record.count(b'"') % 2:
+            continue
+        end = start + len(record)
+        yield start, end, record
+        start = end
+        record = b""
+    if record:
+        yield start, start + len(record), record
+
+
+def build_index(filepath, key="noc_code", encoding="utf-8"):
+    '''Build the index of a csv and write it to its sidecar file
+
+    Args:
+        filepath    : The csv filepath
+        key         : The column holding the codes
+        encoding    : The encoding of the csv
+
+    Returns:
+        index: The header, the encoding and the byte ranges of every code
+    '''
+    stat = _stat(filepath)
+    ranges = {}
+    with open(filepath, 'rb') as input_file:
+        # Skip the byte order mark, the ranges never include it
+        if input_file.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8:
+            if encoding.lower().replace("_", "-") == "utf-8-sig":
+                encoding = "utf-8"
+        else:
+            input_file.seek(0)
+        records = _records(input_file)
+        header = next(records, None)
+        header = next(csv.reader([header[2].decode(encoding)]),
+                      []) if header else []
+        if key not in header:
+            raise ValueError(f"Missing column {key} in {filepath}")
+        key_index = header.index(key)
+
+        for start, end, record in records:
+            row = next(csv.reader(io.StringIO(record.decode(encoding))), [])
+            if key_index >= len(row):
+                continue
+            code_ranges = ranges.setdefault(row[key_index], [])
+            # Rows are grouped by code, extend the last range when contiguous
+            if code_ranges and code_ranges[-1][1] == start:
+                code_ranges[-1][1] = end
+            else:
+                code_ranges.append([start, end])
+
+    index = {
+        "version": VERSION,
+        "stat": stat,
+        "key": key,
+        "encoding": encoding,
+        "header": header,
+        "ranges": ranges,
+    }
+    directory = os.path.dirname(os.path.abspath(filepath))
+    try:
+        fd, tmppath = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    except OSError:
+        # Read only location, the index is only kept in memory
+        return index
+    try:
+        with open(fd, 'w', encoding='utf-8') as output_file:
+            json.dump(index, output_file, ensure_ascii=False)
+        shutil.copymode(filepath, tmppath)
+        os.replace(tmppath, f"{filepath}.{EXTENSION}")
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+    return index
+
+
+def load_index(filepath, key="noc_code", encoding="utf-8"):
+    '''Load the index of a csv, rebuilding it when it is missing or stale
+
+    Args:
+        filepath    : The csv filepath
+        key         : The column holding the codes
+        encoding    : The encoding of the csv
+
+    Returns:
+        index: The header, the encoding and the byte ranges of every code
+    '''
+    try:
+        with open(f"{filepath}.{EXTENSION}", encoding='utf-8') as input_file:
+            index = json.load(input_file)
+        if (index.get("version") == VERSION
+                and index.get("stat") == _stat(filepath)
+                and index.get("key") == key):
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_index(filepath, key, encoding)
+
+
+def _open(filepath, key, encoding):
+    filepath = os.path.abspath(filepath)
+    stat = _stat(filepath)
+    cached = _cache.get((filepath, key))
+    if cached and cached[0] == stat:
+        return cached
+    if cached:
+        close(filepath)
+    index = load_index(filepath, key, encoding)
+    input_file = open(filepath, 'rb')
+    mapped = mmap.mmap(input_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) if stat[0] else b""
+    _cache[(filepath, key)] = (stat, index, input_file, mapped)
+    return _cache[(filepath, key)]
+
+
+def close(filepath=None):
+    '''Release the memory maps of a csv, or of every csv
+
+    Args:
+        filepath: The csv filepath, every csv if empty
+
+    Returns:
+    '''
+    for cache_key in list(_cache.keys()):
+        if filepath and cache_key[0] != os.path.abspath(filepath):
+            continue
+        _, _, input_file, mapped = _cache.pop(cache_key)
+        if mapped:
+            mapped.close()
+        input_file.close()
+
+
+def lookup_rows(filepath, code, key="noc_code", encoding="utf-8"):
+    '''Get the rows of a code as lists
+
+    Args:
+        filepath    : The csv filepath
+        code        : The code to look up
+        key         : The column holding the codes
+        encoding    : The encoding of the csv
+
+    Returns:
+        header  : The columns of the csv
+        rows    : The rows of the code
+    '''
+    _, index, _, mapped = _open(filepath, key, encoding)
+    rows = []
+    for start, end in index["ranges"].get(code, []):
+        text = mapped[start:end].decode(index["encoding"])
+        rows += list(csv.reader(io.StringIO(text)))
+    return index["header"], rows
+
+
+def lookup(filepath, code, key="noc_code", encoding="utf-8"):
+    '''Get the rows of a code as dictionaries
+
+    Args:
+        filepath    : The csv filepath
+        code        : The code to look up
+        key         : The column holding the codes
+        encoding    : The encoding of the csv
+
+    Returns:
+        rows: The rows of the code
+    '''
+    header, rows = lookup_rows(filepath, code, key, encoding)
+    return [dict(zip(header, row)) for row in rows]
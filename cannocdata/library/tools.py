@@ -3,70 +3,154 @@
     These are various tools used by mediacurator
 '''
 
+import argparse
+import codecs
 import copy
 import configparser
+import contextlib
 import os
 import sys
 import csv
+import itertools
 import re
-import chardet
 import shutil
+import struct
 import json
-import requests
+import tempfile
 import uuid
 import time
 # from googletrans import Translator, constants
 # from google_trans_new import google_translator
 # from translate import Translator
 # import goslate
-import argostranslate.package
-import argostranslate.translate
+# The translation stack (argostranslate, requests), chardet and
+# multiprocessing are imported by the functions needing them to keep the
+# startup of the lighter tasks fast
+from array import array
 from difflib import SequenceMatcher
+from . import columnar
+from . import csvindex
+
+
+def split_list(value):
+    return [item for item in value.split(",") if item]
+
+
+ARGUMENTS = {
+    "id": {"help": "The column used to combine the rows"},
+    "translator": {"choices": ["argos", "azure"]},
+    "lang_from": {"help": "The source language"},
+    "lang_to": {"help": "The destination language"},
+    "keys_from": {"type": split_list, "action": "extend", "default": [],
+                  "help": "The columns to translate"},
+    "keys_to": {"type": split_list, "action": "extend", "default": [],
+                "help": "The columns receiving the translations"},
+    "source": {"help": "The source filepath"},
+    "sources": {"type": split_list, "action": "extend", "default": [],
+                "help": "The source filepaths"},
+    "destination": {"help": "The destination filepath"},
+    "columns": {"type": split_list, "action": "extend", "default": [],
+                "help": "The columns to print"},
+    "noc_code": {"help": "Only the rows with this code"},
+    "noc_prefix": {"help": "Only the rows whose code starts with this"},
+    "limit": {"type": int, "help": "The maximum number of rows"},
+    "offset": {"type": int, "help": "The number of rows to skip"},
+    "format": {"help": "The output format"},
+    "workers": {"type": int, "help": "The number of translation processes"},
+    "threads": {"type": int,
+                "help": "The number of threads of each translation process"},
+}
+
+TASKS = {
+    "combine": ["sources", "destination", "id"],
+    "compare_columns": ["source", "destination", "id", "workers"],
+    "print": [
+        "source", "columns", "noc_code", "noc_prefix", "limit", "offset",
+        "format"
+    ],
+    "print_longest": ["source"],
+    "transcode": ["source", "destination"],
+    "translate": [
+        "source", "destination", "translator", "lang_from", "lang_to",
+        "keys_from", "keys_to", "workers", "threads"
+    ],
+    "export": ["source", "destination", "format", "workers", "threads"],
+    "fill_missing": ["source", "destination"],
+    "test": ["sources", "destination"],
+}
+
+# The output formats of the tasks taking a format
+FORMATS = {
+    "print": ["csv", "tsv", "jsonl", "dict"],
+    "export": ["csv", "jsonl", "columnar"],
+}
+
+
+def legacy_arguments(argv):
+    '''Convert the legacy -task:name -option:value syntax to subcommands
 
+    Args:
+        argv: The command line arguments
 
-def load_arguments():
+    Returns:
+        argv: The arguments in the subcommand syntax
+    '''
+    task = []
+    converted = []
+    for arg in argv:
+        match = re.match(r"^-(\w+):(.*)$", arg)
+        if not match:
+            converted.append(arg)
+        elif match.group(1) == "task":
+            task = [match.group(2)]
+        else:
+            converted.append(f"--{match.group(1)}={match.group(2)}")
+    return task + converted
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="cannocdata",
+        description="Tools around the Canadian National Occupational "
+        "Classification")
+    subparsers = parser.add_subparsers(dest="task")
+    for task, options in TASKS.items():
+        subparser = subparsers.add_parser(task)
+        for option in options:
+            kwargs = ARGUMENTS[option]
+            if option == "format":
+                kwargs = dict(kwargs, choices=FORMATS[task])
+            subparser.add_argument(f"--{option}", **kwargs)
+    return parser
+
+
+def load_arguments(argv=None):
     '''Get/load command parameters
 
     Args:
+        argv: The command line arguments, sys.argv if empty
 
     Returns:
         arguments: A dictionary of lists of the options passed by the user
     '''
+    if argv is None:
+        argv = sys.argv[1:]
     arguments = {
-        "id": None,
-        "task": None,
-        "translator": None,
-        "lang_from": None,
-        "lang_to": None,
-        "keys_from": [],
-        "keys_to": [],
-        "source": None,
-        "sources": [],
-        "destination": None,
+        option: [] if kwargs.get("action") == "extend" else None
+        for option, kwargs in ARGUMENTS.items()
     }
-
-    for arg in sys.argv:
-        if "-id:" in arg:
-            arguments["id"] = arg[4:]
-        elif "-task:" in arg:
-            arguments["task"] = arg[6:]
-        elif "-translator:" in arg:
-            arguments["translator"] = arg[12:]
-        elif "-lang_from:" in arg:
-            arguments["lang_from"] = arg[11:]
-        elif "-lang_to:" in arg:
-            arguments["lang_to"] = arg[9:]
-        elif "-keys_from:" in arg:
-            arguments["keys_from"] += arg[11:].split(",")
-        elif "-keys_to:" in arg:
-            arguments["keys_to"] += arg[9:].split(",")
-        elif "-source:" in arg:
-            arguments["source"] = arg[8:]
-        elif "-sources:" in arg:
-            arguments["sources"] += arg[9:].split(",")
-        elif "-destination:" in arg:
-            arguments["destination"] = arg[13:]
-
+    arguments["task"] = None
+    parsed, unknown = get_parser().parse_known_args(legacy_arguments(argv))
+    arguments.update(vars(parsed))
+
+    # Like the legacy parsing, options given to a task they do not belong to
+    # are still read, anything else is ignored
+    parser = argparse.ArgumentParser(add_help=False)
+    for option, kwargs in ARGUMENTS.items():
+        parser.add_argument(f"--{option}", **kwargs)
+    for option, value in vars(parser.parse_known_args(unknown)[0]).items():
+        if value and not arguments[option]:
+            arguments[option] = value
     return arguments
 
 
@@ -103,13 +187,44 @@ def load_config(file="config.ini"):
     return config._sections
 
 
+_config = None
+
+
+def get_config():
+    '''Load the configuration once, on first use
+
+    Returns:
+        config: The parsed configuration
+    '''
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
+
+
+def set_config(config):
+    '''Replace the configuration, ex: to point azure to a local endpoint
+
+    Args:
+        config: The configuration
+    '''
+    global _config
+    _config = config
+
+
 def init_argos(from_code, to_code):
+    import argostranslate.package
     available_packages = argostranslate.package.get_available_packages()
     available_package = list(
         filter(lambda x: x.from_code == from_code and x.to_code == to_code,
                available_packages))[0]
     download_path = available_package.download()
     argostranslate.package.install_from_path(download_path)
+    return load_argos(from_code, to_code)
+
+
+def load_argos(from_code, to_code):
+    import argostranslate.translate
     installed_languages = argostranslate.translate.get_installed_languages()
     from_lang = list(filter(lambda x: x.code == from_code,
                             installed_languages))[0]
@@ -117,26 +232,313 @@ def init_argos(from_code, to_code):
     return from_lang.get_translation(to_lang)
 
 
-def diclist_to_csv(diclist, destination, encoding='utf-8'):
-    keys = diclist[0].keys()
-    with open(destination, 'w', newline="", encoding=encoding) as output_file:
-        dict_writer = csv.DictWriter(output_file, keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(diclist)
+def infer_fieldnames(rows):
+    '''Get the union of the keys of rows in order of appearance
 
+    Args:
+        rows: The dictionaries to inspect
 
-def translate_csv_argos(csv_raw, lang_from='en', lang_to='fr', keys={}):
-    csv_translated = []
-    translator = init_argos(lang_from, lang_to)
-    for data in csv_raw:
-        for k_from, k_to in keys.items():
-            if k_from in data:
-                data[k_to] = translator.translate(data[k_from])
-        csv_translated.append(data)
+    Returns:
+        fieldnames: The ordered column names
+    '''
+    fieldnames = {}
+    for row in rows:
+        for k in row.keys():
+            fieldnames[k] = None
+    return list(fieldnames)
+
+
+def diclist_to_csv(diclist,
+                   destination,
+                   encoding='utf-8',
+                   fieldnames=None,
+                   lookahead=1000,
+                   buffering=1 << 20):
+    '''Stream dictionaries to a csv
+
+    The rows are written to a temporary file next to the destination which
+    then replaces it, so the source and the destination can be the same file.
+
+    Args:
+        diclist     : Any iterable of dictionaries
+        destination : The destination filepath
+        encoding    : The encoding of the csv
+        fieldnames  : The columns to write, inferred from the first rows if
+                      empty
+        lookahead   : The number of rows used to infer the columns
+        buffering   : The size of the write buffer
+
+    Returns:
+        count: The number of rows written
+    '''
+    rows = iter(diclist)
+    if not fieldnames:
+        head = list(itertools.islice(rows, lookahead))
+        fieldnames = infer_fieldnames(head)
+        rows = itertools.chain(head, rows)
+
+    count = 0
+    known = set(fieldnames)
+    extras = set()
+    with atomic_destination(destination) as tmppath:
+        with open(tmppath,
+                  'w',
+                  newline="",
+                  encoding=encoding,
+                  buffering=buffering) as output_file:
+            dict_writer = csv.DictWriter(output_file,
+                                         fieldnames,
+                                         restval="",
+                                         extrasaction='ignore')
+            if fieldnames:
+                dict_writer.writeheader()
+            for row in rows:
+                if not known.issuperset(row.keys()):
+                    extras.update(k for k in row.keys() if k not in known)
+                dict_writer.writerow(row)
+                count += 1
+
+    if extras:
+        print(f"Columns missing from the schema of {destination} were "
+              f"dropped: {', '.join(sorted(extras))}")
+    return count
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextlib.contextmanager
+def atomic_destination(destination):
+    '''Write to a temporary file next to the destination which replaces it
+    once written, it is removed on failure
+
+    Args:
+        destination: The destination filepath
+
+    Returns:
+        tmppath: The temporary filepath to write to
+    '''
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, tmppath = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    os.close(fd)
+    try:
+        yield tmppath
+        if os.path.exists(destination):
+            shutil.copymode(destination, tmppath)
+        else:
+            os.chmod(tmppath, 0o666 & ~_get_umask())
+        os.replace(tmppath, destination)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def diclist_to_jsonl(diclist, destination, buffering=1 << 20):
+    # JSON Lines are always plain utf-8, without byte order mark
+    with atomic_destination(destination) as tmppath:
+        with open(tmppath,
+                  'w',
+                  newline="",
+                  encoding='utf-8',
+                  buffering=buffering) as output_file:
+            for row in diclist:
+                output_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def diclist_to_columnar(diclist,
+                        destination,
+                        group_by=None,
+                        dictionary_columns=("type_english", "type_french")):
+    '''Write a list of dictionaries to a columnar file
+
+    Parquet is used when pyarrow is available, otherwise the builtin columnar
+    format. Each value of group_by is written as its own row group.
+
+    Args:
+        diclist             : The rows to write
+        destination         : The destination filepath without extension
+        group_by            : The column used to split the row groups
+        dictionary_columns  : The low cardinality columns to dictionary encode
+
+    Returns:
+        destination: The written filepath
+    '''
+    columns = []
+    groups = {}
+    for row in diclist:
+        for k in row.keys():
+            if k not in columns:
+                columns.append(k)
+        groups.setdefault(row.get(group_by) if group_by else None,
+                          []).append(row)
+    groups = [("" if k is None else k, v) for k, v in groups.items()]
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        destination = f"{destination}.{columnar.EXTENSION}"
+        with atomic_destination(destination) as tmppath:
+            columnar.write_columnar(groups, tmppath, columns,
+                                    dictionary_columns)
+        return destination
+
+    destination = f"{destination}.parquet"
+    schema = pyarrow.schema([
+        (column,
+         pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+         if column in dictionary_columns else pyarrow.string())
+        for column in columns
+    ])
+    with atomic_destination(destination) as tmppath, \
+            pyarrow.parquet.ParquetWriter(tmppath, schema) as writer:
+        for name, rows in groups:
+            arrays = []
+            for column in columns:
+                values = pyarrow.array([
+                    None if row.get(column) is None else str(row.get(column))
+                    for row in rows
+                ], pyarrow.string())
+                if column in dictionary_columns:
+                    values = values.dictionary_encode()
+                arrays.append(values)
+            table = pyarrow.Table.from_arrays(arrays, schema=schema)
+            writer.write_table(table, row_group_size=max(len(rows), 1))
+    return destination
+
+
+def diclist_to_file(diclist,
+                    destination,
+                    encoding='utf-8',
+                    output_format="csv",
+                    group_by=None):
+    '''Write a list of dictionaries in the requested format
+
+    Args:
+        diclist         : The rows to write
+        destination     : The destination filepath without extension
+        encoding        : The encoding of csv outputs
+        output_format   : One of csv, jsonl or columnar
+        group_by        : The column used to split columnar row groups
+
+    Returns:
+        destination : The written filepath
+        False       : Failed operation
+    '''
+    if output_format not in FORMATS["export"]:
+        print(f"Unknown output format: {output_format}")
+        return False
+    if output_format == "jsonl":
+        destination = f"{destination}.jsonl"
+        diclist_to_jsonl(diclist, destination)
+    elif output_format == "columnar":
+        destination = diclist_to_columnar(diclist, destination, group_by)
+    else:
+        destination = f"{destination}.csv"
+        diclist_to_csv(diclist, destination, encoding)
+    return destination
+
+
+def translate_csv_argos(csv_raw,
+                        lang_from='en',
+                        lang_to='fr',
+                        keys={},
+                        workers=None,
+                        threads=1):
+    csv_translated = list(csv_raw)
+    # One pool for every key, the model is installed and loaded only once
+    targets = [(data, k_from, k_to) for k_from, k_to in keys.items()
+               for data in csv_translated if k_from in data]
+    texts = translate_argos_pool(
+        [data[k_from] for data, k_from, k_to in targets], lang_from, lang_to,
+        workers, threads)
+    for (data, k_from, k_to), text in zip(targets, texts):
+        data[k_to] = text
     return csv_translated
 
 
-def translate_azure(text, lang_from='en', lang_to='fr', config=load_config()):
+_argos_worker = None
+
+
+def _init_argos_worker(from_code, to_code, threads):
+    global _argos_worker
+    os.environ["ARGOS_INTRA_THREADS"] = str(threads)
+    try:
+        import argostranslate.settings
+        argostranslate.settings.intra_threads = threads
+    except (ImportError, AttributeError):
+        pass
+    _argos_worker = load_argos(from_code, to_code)
+
+
+def _translate_argos_batch(texts):
+    return [_argos_worker.translate(text) for text in texts]
+
+
+def translate_argos_pool(texts,
+                         lang_from='en',
+                         lang_to='fr',
+                         workers=None,
+                         threads=1,
+                         batch_size=32):
+    '''Translate texts with a pool of argos workers
+
+    Every worker process loads the model once at start-up and then translates
+    the batches it receives, the results are returned in order.
+
+    Args:
+        texts       : The texts to translate
+        lang_from   : The source language
+        lang_to     : The destination language
+        workers     : The number of worker processes, one per core if empty
+        threads     : The number of intra-op threads of each worker
+        batch_size  : The number of texts sent to a worker at once
+
+    Returns:
+        translations: The translated texts
+    '''
+    texts = list(texts)
+    if not texts:
+        return []
+    if not workers:
+        workers = max(1, (os.cpu_count() or 1) // max(1, threads))
+    workers = min(workers, -(-len(texts) // batch_size))
+
+    # Install the model once before the workers load it
+    engine = init_argos(lang_from, lang_to)
+    if workers <= 1:
+        return [engine.translate(text) for text in texts]
+
+    import multiprocessing
+    batches = [
+        texts[i:i + batch_size] for i in range(0, len(texts), batch_size)
+    ]
+    translations = []
+    with multiprocessing.Pool(workers,
+                              initializer=_init_argos_worker,
+                              initargs=(lang_from, lang_to,
+                                        threads)) as pool:
+        for batch in pool.imap(_translate_argos_batch, batches):
+            translations += batch
+    return translations
+
+
+# Counters of the azure translator, read by the throughput harness
+azure_stats = {"requests": 0, "retries": 0, "characters": 0}
+
+
+def translate_azure(text,
+                    lang_from='en',
+                    lang_to='fr',
+                    config=None,
+                    retries=5):
+    import requests
+    if config is None:
+        config = get_config()
     if 'azure' not in config:
         return False
     endpoint = config['azure']['endpoint']
@@ -151,17 +553,31 @@ def translate_azure(text, lang_from='en', lang_to='fr', config=load_config()):
     body = [{'text': text}]
     try:
         request = requests.post(constructed_url, headers=headers, json=body)
+        azure_stats["requests"] += 1
+        # Throttled or failing service, wait and try again
+        if (request.status_code == 429
+                or request.status_code >= 500) and retries > 0:
+            azure_stats["retries"] += 1
+            delay = request.headers.get("Retry-After")
+            delay = float(delay) if delay else 2**(5 - min(retries, 5))
+            print(f"Azure api returned {request.status_code}: waiting "
+                  f"{delay} seconds and trying again.")
+            time.sleep(delay)
+            return translate_azure(text, lang_from, lang_to, config,
+                                   retries - 1)
         response = request.json()
         if "error" in response:
             print("Error with Azure api:")
             print(f"Code: {response['error']['code']}")
             print(f"Message: {response['error']['message']}")
             exit()
+        azure_stats["characters"] += len(text)
         return response[0]['translations'][0]['text']
     except requests.exceptions.ConnectionError:
+        azure_stats["retries"] += 1
         print("ConnectionError: waiting 5 seconds and trying again.")
         time.sleep(5)
-        return translate_azure(text, lang_from, lang_to, config)
+        return translate_azure(text, lang_from, lang_to, config, retries)
 
 def translate(text,
               lang_from='en',
@@ -176,6 +592,71 @@ def translate(text,
         return engine.translate(text)
 
 
+def normalize_text(text):
+    '''Normalize the whitespaces of a text, including non-breaking spaces
+
+    Args:
+        text: The text to normalize
+
+    Returns:
+        text: The normalized text
+    '''
+    if not text:
+        return ""
+    return " ".join(text.replace(u"\u00a0", " ").split())
+
+
+def translate_unique(texts,
+                     lang_from='en',
+                     lang_to='fr',
+                     translator="argos",
+                     engine=None,
+                     workers=None,
+                     threads=1):
+    '''Translate every distinct text once
+
+    The texts are deduplicated after normalization and a report of the
+    deduplication ratio is printed.
+
+    Args:
+        texts       : The texts needing translation
+        lang_from   : The source language
+        lang_to     : The destination language
+        translator  : The translator to use, argos or azure
+        engine      : An initialized argos translation, used instead of the
+                      worker pool
+        workers     : The number of argos worker processes
+        threads     : The number of intra-op threads of each argos worker
+
+    Returns:
+        translations: A dictionary of normalized texts to their translation
+    '''
+    translations = {}
+    total = 0
+    for text in texts:
+        total += 1
+        translations[normalize_text(text)] = None
+    translations.pop("", None)
+
+    unique = len(translations)
+    if total:
+        print(f"Translating {lang_from} to {lang_to} with {translator}: "
+              f"{total} texts, {unique} unique "
+              f"({1 - unique / total:.1%} deduplicated)")
+    if translator != 'azure' and not engine:
+        translations = dict(
+            zip(
+                translations.keys(),
+                translate_argos_pool(translations.keys(), lang_from, lang_to,
+                                     workers, threads)))
+    for text, translation in translations.items():
+        if translation is None:
+            translations[text] = translate(text, lang_from, lang_to,
+                                           translator, engine)
+    translations[""] = ""
+    return translations
+
+
 def translate_csv_azure(csv_raw, lang_from='en', lang_to='fr', keys={}):
     csv_translated = []
     for data in csv_raw:
@@ -192,29 +673,18 @@ def translate_csv(source=None,
                   lang_from=None,
                   lang_to="en",
                   keys={},
-                  translator="argos"):
-    arguments = load_arguments()
-
-    if arguments['source']:
-        source = arguments['source']
+                  translator="argos",
+                  workers=None,
+                  threads=1):
     if not source:
         return False
 
     if not destination:
         destination = source
 
-    if arguments['lang_from']:
-        lang_from = arguments['lang_from']
-    if arguments['lang_to']:
-        lang_from = arguments['lang_to']
     if not lang_from:
         return False  # TODO detect language
 
-    if arguments["keys_from"] and arguments["keys_to"]:
-        keys = {}
-        if len(arguments["keys_from"]) == len(arguments["keys_to"]):
-            for i in range(len(arguments["keys_from"])):
-                keys[arguments["keys_from"][i]] = arguments["keys_to"][i]
     if not keys:
         return False
 
@@ -226,7 +696,8 @@ def translate_csv(source=None,
     if translator == 'azure':
         csv_translated = translate_csv_azure(csv_raw, lang_from, lang_to, keys)
     else:
-        csv_translated = translate_csv_argos(csv_raw, lang_from, lang_to, keys)
+        csv_translated = translate_csv_argos(csv_raw, lang_from, lang_to, keys,
+                                             workers, threads)
 
     try:
         diclist_to_csv(csv_translated, destination, encoding)
@@ -285,7 +756,226 @@ def get_eleclasses():
         "Renseignements supplémentaires": "Additional information"
     }
 
-def combine_csvs_translate(csv_en, csv_fr, key_en, key_fr, key_match):
+def text_features(text):
+    '''Get cheap language independent features of a text
+
+    Args:
+        text: The text
+
+    Returns:
+        features: The length, the numbers and the punctuation of the text
+    '''
+    text = normalize_text(text).rstrip(".;:")
+    return (len(text), tuple(re.findall(r"\d+", text)),
+            tuple(text.count(c) for c in ",;:()"))
+
+
+def alignment_score(features_en, features_fr, length_ratio=1.15):
+    '''Score how likely two texts are translations of one another
+
+    Args:
+        features_en : The text_features of the english text
+        features_fr : The text_features of the french text
+        length_ratio: The expected length of french texts relative to english
+
+    Returns:
+        score: A score between 0 and 1, 0 when the numbers differ
+    '''
+    if features_en[1] != features_fr[1]:
+        return 0
+    len_en = features_en[0] * length_ratio
+    len_fr = features_fr[0]
+    length = min(len_en, len_fr) / max(len_en, len_fr, 1)
+    punctuation = 1 / (1 + sum(
+        abs(a - b) for a, b in zip(features_en[2], features_fr[2])))
+    return 0.7 * length + 0.3 * punctuation
+
+
+def length_correlation(features_en, features_fr):
+    '''Get the correlation of the lengths of paired texts
+
+    Args:
+        features_en : The text_features of the english texts
+        features_fr : The text_features of the french texts, in pair order
+
+    Returns:
+        correlation: The pearson correlation, 0 when undefined
+    '''
+    x = [features[0] for features in features_en]
+    y = [features[0] for features in features_fr]
+    mean_x = sum(x) / len(x)
+    mean_y = sum(y) / len(y)
+    cov = sum((a - mean_x) * (b - mean_y) for a, b in zip(x, y))
+    var_x = sum((a - mean_x)**2 for a in x)
+    var_y = sum((b - mean_y)**2 for b in y)
+    if not var_x or not var_y:
+        return 0
+    return cov / (var_x * var_y)**0.5
+
+
+def assign_optimal(costs):
+    '''Solve the assignment problem of a square cost matrix (hungarian)
+
+    Args:
+        costs: A list of lists of costs
+
+    Returns:
+        assignment: For each row the index of its assigned column
+    '''
+    n = len(costs)
+    u = [0.0] * (n + 1)
+    v = [0.0] * (n + 1)
+    p = [0] * (n + 1)
+    way = [0] * (n + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float("inf")] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = float("inf")
+            j1 = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    cur = costs[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(n + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    assignment = [0] * n
+    for j in range(1, n + 1):
+        assignment[p[j] - 1] = j - 1
+    return assignment
+
+
+def align_structural(items_en,
+                     items_fr,
+                     threshold=0.4,
+                     correlation=0.5,
+                     margin=0.1,
+                     max_assignment=50):
+    '''Pair english and french elements without translating them
+
+    Both lists are grouped by code and type. When a group has the same number
+    of elements in both languages they are paired by position, or by optimal
+    assignment on cheap features when the positional pairs do not agree.
+
+    Args:
+        items_en        : The english elements (noc_code, type_english,
+                          name_english)
+        items_fr        : The french elements (noc_code, type_french,
+                          name_french)
+        threshold       : The minimal score of every pair of an aligned group
+        correlation     : The minimal length correlation of positional pairs
+        margin          : The minimal lead of an assigned pair over the other
+                          candidates of its row and column
+        max_assignment  : The largest group solved by optimal assignment
+
+    Returns:
+        pairs           : A list of (index in items_en, index in items_fr)
+        leftovers       : The indexes in items_fr which could not be aligned
+    '''
+    elemclasses = get_eleclasses()
+    groups_en = {}
+    for i, item in enumerate(items_en):
+        groups_en.setdefault((item["noc_code"], item["type_english"]),
+                             []).append(i)
+    groups_fr = {}
+    for i, item in enumerate(items_fr):
+        groups_fr.setdefault(
+            (item["noc_code"], elemclasses.get(item["type_french"])),
+            []).append(i)
+
+    # Same shaped groups, with the lengths used to estimate the length ratio
+    # of each element type
+    shaped = {}
+    lengths = {}
+    for key, indexes_fr in groups_fr.items():
+        indexes_en = groups_en.get(key, [])
+        if len(indexes_en) != len(indexes_fr):
+            continue
+        features_en = [
+            text_features(items_en[i]["name_english"]) for i in indexes_en
+        ]
+        features_fr = [
+            text_features(items_fr[i]["name_french"]) for i in indexes_fr
+        ]
+        shaped[key] = (features_en, features_fr)
+        total = lengths.setdefault(key[1], [0, 0])
+        total[0] += sum(features[0] for features in features_en)
+        total[1] += sum(features[0] for features in features_fr)
+
+    pairs = []
+    leftovers = []
+    for key, indexes_fr in groups_fr.items():
+        if key not in shaped:
+            leftovers += indexes_fr
+            continue
+        indexes_en = groups_en[key]
+        features_en, features_fr = shaped[key]
+        total = lengths[key[1]]
+        length_ratio = total[1] / total[0] if total[0] else 1
+        size = len(indexes_en)
+        assignment = list(range(size))
+
+        def pair_score(i, j):
+            return alignment_score(features_en[i], features_fr[j],
+                                   length_ratio)
+
+        positional = all(pair_score(i, i) >= threshold for i in assignment)
+        if positional and size == 2:
+            positional = pair_score(0, 0) + pair_score(1, 1) >= pair_score(
+                0, 1) + pair_score(1, 0)
+        elif positional and size >= 3:
+            positional = length_correlation(features_en,
+                                            features_fr) >= correlation
+        if not positional:
+            if size > max_assignment:
+                leftovers += indexes_fr
+                continue
+            scores = [[pair_score(i, j) for j in assignment]
+                      for i in assignment]
+            assignment = assign_optimal([[1 - score for score in row]
+                                         for row in scores])
+            # Only keep unambiguous assignments, every pair has to beat all
+            # of its alternatives by the margin
+            if any(scores[i][j] < threshold or any(
+                    scores[i][j] - scores[i][k] < margin
+                    for k in assignment if k != j) or any(
+                        scores[i][j] - scores[k][j] < margin
+                        for k in assignment if k != i)
+                   for i, j in enumerate(assignment)):
+                leftovers += indexes_fr
+                continue
+        pairs += [(indexes_en[i], indexes_fr[j])
+                  for i, j in enumerate(assignment)]
+    return pairs, sorted(leftovers)
+
+
+def combine_csvs_translate(csv_en,
+                           csv_fr,
+                           key_en,
+                           key_fr,
+                           key_match,
+                           workers=None,
+                           threads=1):
     if not csv_en or not csv_fr:
         return False
     elemclasses = get_eleclasses()
@@ -306,46 +996,65 @@ def combine_csvs_translate(csv_en, csv_fr, key_en, key_fr, key_match):
         } | combined_csv[i]
 
     if os.path.isfile(csv_fr):
-        argos = init_argos("fr", "en")
         encoding = get_encoding_type(csv_fr).lower()
-        csv_items = csv.DictReader(open(csv_fr, encoding=encoding))
-        # count = 1
+        csv_items = list(csv.DictReader(open(csv_fr, encoding=encoding)))
+
+        # Pair the same shaped groups without translating anything, only the
+        # leftovers go through the translation matching
+        pairs, leftovers = align_structural(combined_csv, csv_items)
+        for i, j in pairs:
+            combined_csv[i]['type_french'] = csv_items[j]['type_french']
+            combined_csv[i]['name_french'] = csv_items[j]['name_french']
+        print(f"Aligned {len(pairs)} of {len(csv_items)} french elements "
+              f"without translation")
+        csv_items = [csv_items[j] for j in leftovers]
+
+        argos_translations = translate_unique(
+            [line['name_french'] for line in csv_items], "fr", "en", "argos",
+            None, workers, threads)
+
+        # Exact matches first, the others are retried once every exact match
+        # has been claimed
+        pending = []
         for line in csv_items:
-            best_matches = {}
             needle = {
                 "noc_code": line['noc_code'],
                 "type_english": elemclasses[line['type_french']],
-                "name_english": None,
+                "name_english": argos_translations[normalize_text(
+                    line['name_french'])],
                 "type_french": None,
                 "name_french": None,
             }
-            translator = "argos"
-            needle["name_english"] = translate(line['name_french'], "fr", "en",
-                                               translator, argos)
-            found = False
-
-
             i, p = loopfind(needle, combined_csv, "name_english")
             if isinstance(i, (int, float)) and p == 1:
-                found = True
                 combined_csv[i]['type_french'] = line['type_french']
                 combined_csv[i]['name_french'] = line['name_french']
-            elif isinstance(i, (int, float)) and p:
-                best_matches[translator] = {
-                    "i": i,
-                    "p": p,
-                    "name_english": needle["name_english"]
-                }
+                continue
+            pending.append(line)
 
-            if not found:
-                translator = "azure"
-                needle["name_english"] = translate(line['name_french'], "fr",
-                                                   "en", translator)
+        azure_translations = translate_unique(
+            [line['name_french'] for line in pending], "fr", "en", "azure")
+        for line in pending:
+            best_matches = {}
+            found = False
+            # Searched again as the rows claimed since the first pass are no
+            # longer candidates
+            for translator, translations in (("argos", argos_translations),
+                                             ("azure", azure_translations)):
+                needle = {
+                    "noc_code": line['noc_code'],
+                    "type_english": elemclasses[line['type_french']],
+                    "name_english": translations[normalize_text(
+                        line['name_french'])],
+                    "type_french": None,
+                    "name_french": None,
+                }
                 i, p = loopfind(needle, combined_csv, "name_english")
                 if isinstance(i, (int, float)) and p == 1:
                     found = True
                     combined_csv[i]['type_french'] = line['type_french']
                     combined_csv[i]['name_french'] = line['name_french']
+                    break
                 elif isinstance(i, (int, float)) and p:
                     best_matches[translator] = {
                         "i": i,
@@ -365,7 +1074,7 @@ def combine_csvs_translate(csv_en, csv_fr, key_en, key_fr, key_match):
                         high_translator = translator
                 combined_csv[high_i]['type_french'] = line['type_french']
                 combined_csv[high_i]['name_french'] = line['name_french']
-            
+
             if not found:
                 combined_csv.append({
                     "noc_code": line['noc_code'],
@@ -375,28 +1084,297 @@ def combine_csvs_translate(csv_en, csv_fr, key_en, key_fr, key_match):
                     "name_french": line['name_french'],
                 })
 
-            # if count > 100:
-            #     print(json.dumps(combined_csv, indent=4))
-            #     exit()
-            # count += 1
-    # print(combined_csv)
-    # print(json.dumps(combined_csv, indent=4))
-    # exit()
-
+    translations = translate_unique([
+        item["name_english"] for item in combined_csv
+        if not item["name_french"]
+    ], "en", "fr", "azure")
     for i in range(len(combined_csv)):
         if not combined_csv[i]["type_french"]:
             for k, v in elemclasses.items():
                 if v == combined_csv[i]["type_english"]:
                     combined_csv[i]["type_french"] = k
-        
+
         if not combined_csv[i]["name_french"]:
-            combined_csv[i]["name_french"] = translate(combined_csv[i]["name_english"], translator = "azure")
+            combined_csv[i]["name_french"] = translations[normalize_text(
+                combined_csv[i]["name_english"])]
 
     return combined_csv, encoding
 
 
-def compare_columns(source=None, keys_from={}, keys_to={}):
-    return False
+def _hash_row(row, indexes):
+    '''Hash the values of a row into one packed digest, empty values hash
+    to 0
+
+    Args:
+        row     : The values of the row
+        indexes : The index of every compared column in the row, None when
+                  the column is missing
+
+    Returns:
+        digest: A marker byte followed by the 64 bits hash of every compared
+                column
+    '''
+    return b"\x01" + array(
+        'Q',
+        ((hash(row[i]) & 0xFFFFFFFFFFFFFFFF) or 1
+         if i is not None and i < len(row) and row[i] else 0
+         for i in indexes)).tobytes()
+
+
+def _keyed_rows(filepath, key, columns):
+    '''Stream the hashed rows of a csv with their join key
+
+    Args:
+        filepath    : The csv filepath
+        key         : The key column
+        columns     : The compared columns
+
+    Returns:
+        rows: An iterator of (key, row digest)
+    '''
+    encoding = get_encoding_type(filepath, sample=65536).lower()
+    with open(filepath, newline="", encoding=encoding) as input_file:
+        reader = csv.reader(input_file)
+        header = next(reader, [])
+        key_index = header.index(key)
+        indexes = [header.index(c) if c in header else None for c in columns]
+        for row in reader:
+            if key_index >= len(row):
+                continue
+            yield row[key_index], _hash_row(row, indexes)
+
+
+def _partition_rows(rows, directory, name, buckets):
+    '''Split keyed rows into bucket files by the hash of their key
+
+    The rows of a key all land in the same bucket, in their original order.
+
+    Args:
+        rows        : An iterator of (key, row digest)
+        directory   : The directory of the bucket files
+        name        : The prefix of the bucket files
+        buckets     : The number of buckets
+
+    Returns:
+    '''
+    outputs = [
+        open(os.path.join(directory, f"{name}{i}"), 'wb', buffering=1 << 16)
+        for i in range(buckets)
+    ]
+    try:
+        for key, digest in rows:
+            data = key.encode('utf-8')
+            outputs[hash(key) % buckets].write(
+                struct.pack('<I', len(data)) + data + digest)
+    finally:
+        for output_file in outputs:
+            output_file.close()
+
+
+def _bucket_rows(filepath, size):
+    '''Stream the keyed rows of a bucket file written by _partition_rows
+
+    Args:
+        filepath    : The bucket filepath
+        size        : The size of the row digests
+
+    Returns:
+        rows: An iterator of (key, row digest)
+    '''
+    with open(filepath, 'rb', buffering=1 << 16) as input_file:
+        for length in iter(lambda: input_file.read(4), b""):
+            length = struct.unpack('<I', length)[0]
+            yield input_file.read(length).decode('utf-8'), input_file.read(size)
+
+
+def get_key_column(header, id=None):
+    for column in [id] if id else ["noc_code", "code"]:
+        if column in header:
+            return column
+    return None
+
+
+def compare_csvs(source, destination, id=None, bucket_size=1 << 26):
+    '''Compare the columns of two csvs joined on a key column
+
+    The hashes of the source rows are kept in memory, O(source rows) with 8
+    bytes per compared column. When the source is larger than bucket_size,
+    both files are first split into temporary buckets by the hash of their
+    key and compared bucket by bucket, so only one bucket is in memory
+    (up to 256 buckets).
+
+    Args:
+        source      : The source csv filepath
+        destination : The destination csv filepath
+        id          : The key column of both csvs, noc_code or code if empty
+        bucket_size : The source bytes compared in memory at once
+
+    Returns:
+        report: The added, removed and changed rows and column values
+        False: Failed operation
+    '''
+    headers = []
+    for filepath in (source, destination):
+        encoding = get_encoding_type(filepath, sample=65536).lower()
+        with open(filepath, newline="", encoding=encoding) as input_file:
+            headers.append(next(csv.reader(input_file), []))
+    # Both files must be joined on the same column
+    key = get_key_column(headers[0], id)
+    for filepath, header in zip((source, destination), headers):
+        if not key or key not in header:
+            print(f"Missing key column {key or id or 'noc_code'} in "
+                  f"{filepath}")
+            return False
+    columns = list(
+        dict.fromkeys(column for header in headers for column in header
+                      if column != key))
+
+    report = {
+        "source": source,
+        "destination": destination,
+        "key": key,
+        "rows": {"added": 0, "removed": 0, "changed": 0, "unchanged": 0},
+        "columns": {
+            column: {"added": 0, "removed": 0, "changed": 0}
+            for column in columns
+        },
+        "columns_added": [c for c in headers[1] if c not in headers[0]],
+        "columns_removed": [c for c in headers[0] if c not in headers[1]],
+    }
+    stats = [report["columns"][column] for column in columns]
+
+    def count(digest_from, digest_to):
+        hashes_from = array('Q', digest_from[1:])
+        hashes_to = array('Q', digest_to[1:])
+        for i in range(len(columns)):
+            if hashes_from[i] == hashes_to[i]:
+                continue
+            if not hashes_from[i]:
+                stats[i]["added"] += 1
+            elif not hashes_to[i]:
+                stats[i]["removed"] += 1
+            else:
+                stats[i]["changed"] += 1
+
+    size = 1 + 8 * len(columns)
+    empty = b"\x01" + bytes(size - 1)
+
+    def diff(rows_from, rows_to):
+        # The digests of the rows sharing a key are concatenated, one bytes
+        # per key, and matched in order with the destination rows
+        hashed = {}
+        for value, digest in rows_from:
+            if value not in hashed:
+                hashed[value] = bytearray()
+            hashed[value] += digest
+        matched = {}
+        for value, digest in rows_to:
+            occurrence = matched.get(value, 0)
+            previous = hashed.get(value, b"")[occurrence *
+                                              size:(occurrence + 1) * size]
+            if not previous:
+                report["rows"]["added"] += 1
+                count(empty, digest)
+                continue
+            matched[value] = occurrence + 1
+            if previous == digest:
+                report["rows"]["unchanged"] += 1
+            else:
+                report["rows"]["changed"] += 1
+                count(previous, digest)
+        for value, digests in hashed.items():
+            for start in range(matched.get(value, 0) * size, len(digests),
+                               size):
+                report["rows"]["removed"] += 1
+                count(digests[start:start + size], empty)
+
+    buckets = min(256, os.path.getsize(source) // bucket_size + 1)
+    if buckets == 1:
+        diff(_keyed_rows(source, key, columns),
+             _keyed_rows(destination, key, columns))
+        return report
+    with tempfile.TemporaryDirectory() as directory:
+        _partition_rows(_keyed_rows(source, key, columns), directory, "source",
+                        buckets)
+        _partition_rows(_keyed_rows(destination, key, columns), directory,
+                        "destination", buckets)
+        for i in range(buckets):
+            diff(_bucket_rows(os.path.join(directory, f"source{i}"), size),
+                 _bucket_rows(os.path.join(directory, f"destination{i}"),
+                              size))
+    return report
+
+
+def print_comparison(report):
+    rows = report["rows"]
+    print(f"Comparing {report['source']} to {report['destination']} "
+          f"on {report['key']}:")
+    print(f"Rows: {rows['added']} added, {rows['removed']} removed, "
+          f"{rows['changed']} changed, {rows['unchanged']} unchanged")
+    if report["columns_added"]:
+        print(f"Columns added: {', '.join(report['columns_added'])}")
+    if report["columns_removed"]:
+        print(f"Columns removed: {', '.join(report['columns_removed'])}")
+    width = max([len(column) for column in report["columns"]] + [6]) + 5
+    t1 = "Column"
+    print(f"{t1:{width}} | {'Added':>8} | {'Removed':>8} | {'Changed':>8}")
+    for column, stats in report["columns"].items():
+        print(f"{column:{width}} | {stats['added']:>8} | "
+              f"{stats['removed']:>8} | {stats['changed']:>8}")
+    print()
+
+
+def compare_columns(source=None, destination=None, id=None, workers=None):
+    '''Compare the columns of two csvs, or of the csvs of two directories
+
+    The csvs found in both directories are compared in parallel.
+
+    Args:
+        source      : The source csv or directory
+        destination : The destination csv or directory
+        id          : The key column of the csvs, noc_code or code if empty
+        workers     : The number of processes comparing directories
+
+    Returns:
+        reports: The comparison reports
+        False: Failed operation
+    '''
+    if not source or not destination:
+        return False
+
+    if os.path.isfile(source) and os.path.isfile(destination):
+        report = compare_csvs(source, destination, id)
+        if not report:
+            return False
+        print_comparison(report)
+        return [report]
+
+    if not os.path.isdir(source) or not os.path.isdir(destination):
+        return False
+
+    filenames_from = {f for f in os.listdir(source) if f.endswith('.csv')}
+    filenames_to = {f for f in os.listdir(destination) if f.endswith('.csv')}
+    for filename in sorted(filenames_from - filenames_to):
+        print(f"Only in {source}: {filename}")
+    for filename in sorted(filenames_to - filenames_from):
+        print(f"Only in {destination}: {filename}")
+
+    pairs = [(os.path.join(source, filename),
+              os.path.join(destination, filename), id)
+             for filename in sorted(filenames_from & filenames_to)]
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(pairs))
+    if workers <= 1:
+        reports = [compare_csvs(*pair) for pair in pairs]
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(workers) as pool:
+            reports = pool.starmap(compare_csvs, pairs)
+    for report in reports:
+        if report:
+            print_comparison(report)
+    return reports
 
 
 def combine_csvs(sources, destination, id=None):
@@ -410,28 +1388,135 @@ def combine_csvs(sources, destination, id=None):
     if not id:
         combined_csv, encoding = combine_csvs_lfl(sources, destination)
     else:
-        combined_csv, encoding = combine_csvs_id(sources, destination, id)
+        combined_csv, encoding = combine_csvs_id(sources, id)
 
     if combined_csv:
-        diclist_to_csv(combined_csv, destination, encoding)
+        diclist_to_csv(combined_csv, destination, encoding,
+                       read_fieldnames(sources))
 
 
-def print_csv(filepath):
+def read_fieldnames(sources):
+    '''Get the union of the headers of csvs
+
+    Args:
+        sources: The csv filepaths
+
+    Returns:
+        fieldnames: The ordered column names
     '''
+    fieldnames = {}
+    for source in sources:
+        if os.path.isfile(source):
+            encoding = get_encoding_type(source, sample=65536).lower()
+            with open(source, newline="", encoding=encoding) as input_file:
+                for k in next(csv.reader(input_file), []):
+                    fieldnames[k] = None
+    return list(fieldnames)
+
+
+def print_csv(filepath,
+              columns=None,
+              noc_code=None,
+              noc_prefix=None,
+              limit=None,
+              offset=0,
+              output_format="csv",
+              key="noc_code"):
+    '''Stream the rows of a csv to stdout
+
+    The file is read lazily and reading stops as soon as the limit is
+    reached, rows are written through the buffered sys.stdout.
 
     Args:
-        filepath: the filepath of the csv
+        filepath        : the filepath of the csv
+        columns         : the columns to print, all of them if empty
+        noc_code        : only print the rows with this exact code
+        noc_prefix      : only print the rows whose code starts with this
+        limit           : the maximum number of rows to print
+        offset          : the number of matching rows to skip
+        output_format   : one of csv, tsv, jsonl or dict
+        key             : the column holding the code, falls back to "code"
 
     Returns:
         False: Failed operation
     '''
     if not os.path.isfile(filepath):
         return False
+    if output_format not in FORMATS["print"]:
+        print(f"Unknown output format: {output_format}")
+        return False
+
+    encoding = get_encoding_type(filepath, sample=65536).lower()
+    with open(filepath, newline="", encoding=encoding) as input_file:
+        reader = csv.reader(input_file)
+        header = next(reader, None)
+        if not header:
+            return False
+
+        if key not in header and "code" in header:
+            key = "code"
+        key_index = header.index(key) if key in header else None
+        if (noc_code is not None or noc_prefix) and key_index is None:
+            print(f"Missing column {key} in {filepath}")
+            return False
 
-    csv_raw = csv.DictReader(
-        open(filepath, encoding=get_encoding_type(filepath).lower()))
-    for row in csv_raw:
-        print(row)
+        # The rows of a single code are read from the offset index
+        if noc_code is not None and encoding.startswith("utf-8"):
+            reader = iter(
+                csvindex.lookup_rows(filepath, noc_code, key, encoding)[1])
+
+        if columns:
+            missing = [column for column in columns if column not in header]
+            if missing:
+                print(f"Missing columns in {filepath}: {', '.join(missing)}")
+                return False
+            indexes = [header.index(column) for column in columns]
+        else:
+            columns = header
+            indexes = list(range(len(header)))
+
+        # sys.stdout is already a buffered text stream, and writing to it
+        # keeps working when it is redirected
+        output = sys.stdout
+        try:
+            if output_format in ("csv", "tsv"):
+                writer = csv.writer(
+                    output, delimiter="\t" if output_format == "tsv" else ",")
+                writer.writerow(columns)
+                write = writer.writerow
+            elif output_format == "jsonl":
+                write = lambda values: output.write(
+                    json.dumps(dict(zip(columns, values)), ensure_ascii=False)
+                    + "\n")
+            else:
+                write = lambda values: output.write(
+                    f"{dict(zip(columns, values))}\n")
+
+            skipped = 0
+            printed = 0
+            # Stop reading as soon as the limit is reached
+            if limit is not None and limit <= 0:
+                reader = iter(())
+            for row in reader:
+                if key_index is not None and key_index < len(row):
+                    code = row[key_index]
+                    if noc_code is not None and code != noc_code:
+                        continue
+                    if noc_prefix and not code.startswith(noc_prefix):
+                        continue
+                if offset and skipped < offset:
+                    skipped += 1
+                    continue
+                write([row[i] if i < len(row) else "" for i in indexes])
+                printed += 1
+                if limit is not None and printed >= limit:
+                    break
+            output.flush()
+        except BrokenPipeError:
+            # The reader went away (ex: piped into head), nothing left to do.
+            # Point stdout to devnull so flushing it at exit does not fail.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, output.fileno())
 
 
 def print_longest(path):
@@ -469,12 +1554,41 @@ def print_longest(path):
         print()
 
 
-def get_encoding_type(filepath=None, bytearr=None):
+def get_encoding_type(filepath=None, bytearr=None, sample=None):
+    '''Detect the encoding of a file or of a bytearray
+
+    Args:
+        filepath    : The filepath to inspect
+        bytearr     : The bytes to inspect
+        sample      : Only inspect this many bytes from the start of the file
+
+    Returns:
+        encoding: The detected encoding
+    '''
     if filepath and os.path.exists(filepath):
         with open(filepath, 'rb') as file:
-            return chardet.detect(file.read())['encoding']
+            if not sample:
+                import chardet
+                return chardet.detect(file.read())['encoding']
+            head = file.read(sample)
+            # Most files are utf-8, which is checked without chardet. The
+            # incremental decoder tolerates a character cut by the sample.
+            if head.startswith(codecs.BOM_UTF8):
+                return 'utf-8-sig'
+            try:
+                codecs.getincrementaldecoder('utf-8')().decode(head)
+                return 'utf-8'
+            except UnicodeDecodeError:
+                pass
+            import chardet
+            encoding = chardet.detect(head)['encoding']
+            # A plain ascii head may be followed by utf-8 content
+            if not encoding or encoding.lower() == 'ascii':
+                return 'utf-8'
+            return encoding
     elif bytearr:
-        chardet.detect(bytearr)['encoding']
+        import chardet
+        return chardet.detect(bytearr)['encoding']
 
 
 def transcode(source, destination=None, destination_codec='utf-8'):
@@ -560,22 +1674,41 @@ def fill_missing(source, destination):
         return False
 
     encoding = get_encoding_type(source).lower()
-    csv_items = list(csv.DictReader(open(source, encoding=encoding)))
     elemclasses = get_eleclasses()
 
-    for i in range(len(csv_items)):
-        if not csv_items[i]["type_french"]:
-            for k, v in elemclasses.items():
-                if v == csv_items[i]["type_english"]:
-                    csv_items[i]["type_french"] = k
-        
-        if not csv_items[i]["name_french"]:
-            csv_items[i]["name_french"] = translate(csv_items[i]["name_english"], translator = "azure")
-    
-    diclist_to_csv(csv_items, destination, encoding)
-
-
-def export(source, destination, id=None):
+    with open(source, newline="", encoding=encoding) as input_file:
+        translations = translate_unique(
+            (csv_item["name_english"]
+             for csv_item in csv.DictReader(input_file)
+             if not csv_item["name_french"]), "en", "fr", "azure")
+
+    def fill(csv_items):
+        for csv_item in csv_items:
+            if not csv_item["type_french"]:
+                for k, v in elemclasses.items():
+                    if v == csv_item["type_english"]:
+                        csv_item["type_french"] = k
+
+            if not csv_item["name_french"]:
+                csv_item["name_french"] = translations[normalize_text(
+                    csv_item["name_english"])]
+            yield csv_item
+
+    with open(source, newline="", encoding=encoding) as input_file:
+        csv_items = csv.DictReader(input_file)
+        diclist_to_csv(fill(csv_items), destination, encoding,
+                       csv_items.fieldnames)
+
+
+def export(source,
+           destination,
+           id=None,
+           output_format="csv",
+           workers=None,
+           threads=1):
+    if output_format not in FORMATS["export"]:
+        print(f"Unknown output format: {output_format}")
+        return False
     if not os.path.isdir(os.path.join(destination, "elements")):
         os.makedirs(os.path.join(destination, "elements"))
     csvspaths = {
@@ -638,10 +1771,10 @@ def export(source, destination, id=None):
                 allitems.append(newitem)
 
             for ke, va in classified.items():
-                diclist_to_csv(
+                diclist_to_file(
                     va,
-                    os.path.join(destination, "elements", f"{ke}_{lang}.csv"),
-                    encoding)
+                    os.path.join(destination, "elements", f"{ke}_{lang}"),
+                    encoding, output_format)
 
         elif k == "elem_fr":
             lang = "fr"
@@ -673,32 +1806,27 @@ def export(source, destination, id=None):
                 allitems.append(newitem)
 
             for ke, va in classified.items():
-                diclist_to_csv(
+                diclist_to_file(
                     va,
-                    os.path.join(destination, "elements", f"{ke}_{lang}.csv"),
-                    encoding)
+                    os.path.join(destination, "elements", f"{ke}_{lang}"),
+                    encoding, output_format)
 
         elif k == "cls_en":
             filename = "classes"
-            for line in csvs[k]:
-                newitem = {
-                    "noc_code": line["Code - NOC 2021 V1.0"].strip(),
-                    "name_english": line["Class title"].strip(),
-                    "description_english": line["Class definition"].strip(),
-                }
-                allitems.append(newitem)
+            allitems = ({
+                "noc_code": line["Code - NOC 2021 V1.0"].strip(),
+                "name_english": line["Class title"].strip(),
+                "description_english": line["Class definition"].strip(),
+            } for line in csvs[k])
 
         elif k == "cls_fr":
             filename = "classes"
             lang = "fr"
-            for line in csvs[k]:
-                newitem = {
-                    "noc_code": line["Code dela CNP 2021 v1.0"].strip(),
-                    "name_french": line["Titres de classes"].strip(),
-                    "description_french":
-                    line["Définitions de la classe"].strip(),
-                }
-                allitems.append(newitem)
+            allitems = ({
+                "noc_code": line["Code dela CNP 2021 v1.0"].strip(),
+                "name_french": line["Titres de classes"].strip(),
+                "description_french": line["Définitions de la classe"].strip(),
+            } for line in csvs[k])
 
         diclist_to_csv(allitems,
                        os.path.join(destination, f"{filename}_{lang}.csv"),
@@ -708,17 +1836,18 @@ def export(source, destination, id=None):
         os.path.join(destination, "classes_en.csv"),
         os.path.join(destination, "classes_fr.csv")
     ]
-    diclist_to_csv(
+    diclist_to_file(
         combine_csvs_id(sources, 'noc_code')[0],
-        os.path.join(destination, "classes.csv"), encoding)
+        os.path.join(destination, "classes"), encoding, output_format)
 
-    diclist_to_csv(
+    diclist_to_file(
         combine_csvs_translate(
             os.path.join(destination, "elements_en.csv"),
             os.path.join(destination, "elements_fr.csv"),
-            'name_english', 'name_french', 'noc_code'
+            'name_english', 'name_french', 'noc_code', workers, threads
         )[0],
-        os.path.join(destination, "elements.csv"), encoding)
+        os.path.join(destination, "elements"), encoding, output_format,
+        "type_english")
 
 
 def loopfind(needle, haystack, key_match):